@@ -1,4 +1,4 @@
-#!/usr/bin/python -u
+#!/usr/bin/python3 -u
 ## The -u option turns off block buffering of python output. This assures
 ## that error messages get printed to the log file as they happen.
 #  
@@ -55,7 +55,7 @@ def createRrdFile():
     """
 
     if os.path.exists(_RRD_FILE):
-        print "rrdtool weather database file already exists!"
+        print("rrdtool weather database file already exists!")
         return True
 
     ## Calculate database size
@@ -77,14 +77,15 @@ def createRrdFile():
                 heartBeat, heartBeat, heartBeat, heartBeat, heartBeat, \
                 heartBeat, rrd48hrNumRows, rra1yrNumPDP, rrd1yearNumRows)
     
-    print "Creating rrdtool database...\n\n%s\n" % strCmd # DEBUG
+    print("Creating rrdtool database...\n\n%s\n" % strCmd) # DEBUG
 
     # Run the command in a subprocess.
     try:
         subprocess.check_output(strCmd, stderr=subprocess.STDOUT, \
                                 shell=True)
-    except subprocess.CalledProcessError, exError:
-        print "rrdtool create failed: %s" % (exError.output)
+    except subprocess.CalledProcessError as exError:
+        print("rrdtool create failed: %s" % \
+              exError.output.decode('utf-8'))
         return False
     return True
 ##end def
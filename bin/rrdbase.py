@@ -27,9 +27,49 @@
 #
 #2345678901234567890123456789012345678901234567890123456789012345678901234567890
 
+import logging
+import warnings
+import queue
 import subprocess
+import threading
 import time
 
+# Use the rrdtool python bindings, if installed, to run rrdtool commands
+# in this process.  Otherwise run the rrdtool command line app.
+try:
+    import rrdtool
+except ImportError:
+    rrdtool = None
+
+logger = logging.getLogger(__name__)
+
+# The rrdtool library is not thread safe, so calls to the python bindings
+# are made one at a time.
+_rrdtoolLock = threading.Lock()
+
+# rrdtool graph arguments that show the wind direction as color coded
+# areas below a wind speed chart
+_WIND_DIRECTION_ARGS = (
+    'VDEF:wMax=dSeries,MAXIMUM',
+    'CDEF:wMaxScaled=dSeries,0,*,wMax,+,-0.15,*',
+    'CDEF:ndir=wDir,337.5,GE,wDir,22.5,LE,+,wMaxScaled,0,IF',
+    'CDEF:nedir=wDir,22.5,GT,wDir,67.5,LT,*,wMaxScaled,0,IF',
+    'CDEF:edir=wDir,67.5,GE,wDir,112.5,LE,*,wMaxScaled,0,IF',
+    'CDEF:sedir=wDir,112.5,GT,wDir,157.5,LT,*,wMaxScaled,0,IF',
+    'CDEF:sdir=wDir,157.5,GE,wDir,202.5,LE,*,wMaxScaled,0,IF',
+    'CDEF:swdir=wDir,202.5,GT,wDir,247.5,LT,*,wMaxScaled,0,IF',
+    'CDEF:wdir=wDir,247.5,GE,wDir,292.5,LE,*,wMaxScaled,0,IF',
+    'CDEF:nwdir=wDir,292.5,GT,wDir,337.5,LT,*,wMaxScaled,0,IF',
+    'AREA:ndir#0000FF:N',    # Blue
+    'AREA:nedir#1E90FF:NE',  # DodgerBlue
+    'AREA:edir#00FFFF:E',    # Cyan
+    'AREA:sedir#00FF00:SE',  # Lime
+    'AREA:sdir#FFFF00:S',    # Yellow
+    'AREA:swdir#FF8C00:SW',  # DarkOrange 
+    'AREA:wdir#FF0000:W',    # Red
+    'AREA:nwdir#FF00FF:NW',  # Magenta
+)
+
 class rrdbase:
 
     def __init__(self, rrdFile, chartsDirectory, chartWidth, \
@@ -50,15 +90,33 @@ class rrdbase:
         self.chartsDirectory = chartsDirectory
         self.chartWidth = chartWidth
         self.chartHeight = chartHeight
+        # chart size arguments common to all rrdtool graph commands
+        self.chartSizeArgs = ['-w', str(chartWidth), '-h', str(chartHeight)]
         self.verboseMode = verboseMode
         self.debugMode = debugMode
+        # rrdtool command line app processes running in pipe mode that
+        # are waiting for the next command
+        self.idlePipes = queue.Queue()
+        # True if graphs may be created by several threads at once.  The
+        # rrdtool python bindings are not thread safe, so their calls
+        # are made one at a time, while each command line app process
+        # runs independently.
+        self.parallelGraphs = rrdtool is None
+        # rrdtool graph commands already formatted, keyed by the
+        # createWeaGraph arguments
+        self.graphCommands = {}
     ## end def
 
     def getTimeStamp():
         """Sets the error message time stamp to the local system time.
+           Deprecated: messages are now time stamped by the logging
+           module.
            Parameters: none
            Returns: string containing the time stamp
         """
+        warnings.warn('rrdbase.getTimeStamp is deprecated; use the ' \
+                      'logging module to time stamp messages', \
+                      DeprecationWarning, stacklevel=2)
         return time.strftime('%m/%d/%Y %H:%M:%S', time.localtime())
     ## end def
 
@@ -73,55 +131,174 @@ class rrdbase:
         try:
             t_sTime = time.strptime(sTime, '%m/%d/%Y %H:%M:%S')
         except Exception as exError:
-            print('%s getEpochSeconds: %s' % \
-                  (rrdbase.getTimeStamp(), exError))
+            logger.error('getEpochSeconds: %s', exError)
             return None
         tSeconds = int(time.mktime(t_sTime))
         return tSeconds
     ## end def
 
+    def quoteArgument(sArg):
+        """Quotes a rrdtool command argument that contains spaces or
+           quote characters, so that rrdtool running in pipe mode reads
+           it as one argument.  rrdtool removes quotes from a command
+           line as a shell does, but has no escape character, so double
+           quote characters are put in single quotes and the rest of the
+           argument in double quotes.
+           Parameters:
+               sArg - the command argument
+           Returns: string containing the quoted argument; raises a
+                    ValueError exception if the argument contains a
+                    newline, which would end the command
+        """
+        if '\n' in sArg:
+            raise ValueError('newline in argument %r' % sArg)
+        if sArg and ' ' not in sArg and '"' not in sArg and \
+           "'" not in sArg:
+            return sArg
+        return '\'"\''.join('"%s"' % sPart for sPart in sArg.split('"'))
+    ## end def
+
+    def closePipes(self):
+        """Stops the rrdtool command line app processes waiting for
+           commands.
+           Parameters: none
+           Returns: nothing
+        """
+        while True:
+            try:
+                pipe = self.idlePipes.get_nowait()
+            except queue.Empty:
+                break
+            pipe.stdin.close()
+            pipe.wait()
+    ## end def
+
+    def runRrdtool(self, lCmd):
+        """Runs a rrdtool command, either by calling the rrdtool python
+           bindings or by sending the command to the rrdtool command line
+           app running in pipe mode.  The app processes are kept running
+           and reused for later commands, so that each command does not
+           start a new process.
+           Parameters:
+               lCmd - a sequence containing the rrdtool command, such as
+                      'update' or 'graph', followed by its arguments
+           Returns: string containing the command output if successful,
+                    None otherwise
+        """
+        if self.debugMode:
+            logger.debug('rrdtool %s', ' '.join(lCmd)) # DEBUG
+
+        if rrdtool is not None:
+            try:
+                with _rrdtoolLock:
+                    result = getattr(rrdtool, lCmd[0])(*lCmd[1:])
+            except rrdtool.OperationalError as exError:
+                logger.error('rrdtool %s failed: %s', lCmd[0], exError)
+                return None
+            # The graph command returns the size of the chart.
+            if isinstance(result, tuple):
+                return '%sx%s' % result[:2]
+            return ''
+
+        try:
+            sLine = ' '.join(map(rrdbase.quoteArgument, lCmd)) + '\n'
+        except ValueError as exError:
+            logger.error('rrdtool %s failed: %s', lCmd[0], exError)
+            return None
+
+        # Use an idle rrdtool process, or start a new one if all the
+        # processes are busy with commands from other threads.
+        try:
+            pipe = self.idlePipes.get_nowait()
+        except queue.Empty:
+            try:
+                pipe = subprocess.Popen(['rrdtool', '-'], \
+                           stdin=subprocess.PIPE, stdout=subprocess.PIPE, \
+                           stderr=subprocess.STDOUT, text=True)
+            except OSError as exError:
+                logger.error('rrdtool %s failed: %s', lCmd[0], exError)
+                return None
+
+        # Send the command and read the output up to the line reporting
+        # the command status.
+        lOutput = []
+        try:
+            pipe.stdin.write(sLine)
+            pipe.stdin.flush()
+            while True:
+                line = pipe.stdout.readline()
+                if not line:
+                    raise OSError('rrdtool process exited')
+                if line.startswith('OK') or line.startswith('ERROR'):
+                    break
+                lOutput.append(line)
+        except OSError as exError:
+            logger.error('rrdtool %s failed: %s', lCmd[0], exError)
+            pipe.kill()
+            pipe.wait()
+            return None
+        self.idlePipes.put(pipe)
+
+        if line.startswith('ERROR'):
+            logger.error('rrdtool %s failed: %s', lCmd[0], line[6:].strip())
+            return None
+        return ''.join(lOutput).strip()
+    ## end def
+
     def updateDatabase(self, *tData):
         """Updates the rrdtool round robin database with data supplied in
            the weather data string.
            Parameters:
                tData - a tuple object containing the data items to be written
-                       to the rrdtool database
+                       to the rrdtool database; the first item is the time
+                       of the data, either in epoch seconds or as a time
+                       stamp formatted as %m/%d/%Y %H:%M:%S
            Returns: True if successful, False otherwise
         """
-        # Get the time stamp supplied with the data.  This must always be
-        # the first element of the tuple argument passed to this function.
-        tData = list(tData)
-        date = tData.pop(0)
-        # Convert the time stamp to unix epoch seconds.
-        try:
-            time = rrdbase.getEpochSeconds(date)
-        # Trap any data conversion errors.
-        except Exception as exError:
-            print('%s updateDatabase error: %s' % \
-                  (rrdbase.getTimeStamp(), exError))
-            return False
+        return self.updateDatabaseBatch([tData])
+    ## end def
 
-        # Create the rrdtool command for updating the rrdtool database.  Add a
-        # '%s' format specifier for each data item remaining in tData. 
-        # Note that this is the list remaining after the
-        # first item (the date) has been removed by the above code.
-        strFmt = 'rrdtool update %s %s' + ':%s' * len(tData)
-        strCmd = strFmt % ((self.rrdFile, time,) + tuple(tData))
+    def updateDatabaseBatch(self, lData):
+        """Updates the rrdtool round robin database with several samples
+           of data in a single rrdtool command.
+           Parameters:
+               lData - a list of tuple objects, in time order, each
+                       containing the data items of one sample as
+                       described for updateDatabase
+           Returns: True if successful, False otherwise
+        """
+        lSamples = []
+        for tData in lData:
+            # Get the time stamp supplied with the data.  This must always
+            # be the first element of the tuple.
+            tData = list(tData)
+            date = tData.pop(0)
+            # Convert a formatted time stamp to unix epoch seconds.
+            if isinstance(date, str):
+                time = rrdbase.getEpochSeconds(date)
+                if time is None:
+                    continue
+            else:
+                time = int(date)
 
-        if self.debugMode:
-            print('%s' % strCmd) # DEBUG
+            # Format the sample for the rrdtool update command.  Add a
+            # '%s' format specifier for each data item remaining in tData. 
+            # Note that this is the list remaining after the
+            # first item (the date) has been removed by the above code.
+            strFmt = '%s' + ':%s' * len(tData)
+            lSamples.append(strFmt % ((time,) + tuple(tData)))
+        ## end for
 
-        # Run the formatted command as a subprocess.
-        try:
-            subprocess.check_output(strCmd, stderr=subprocess.STDOUT, \
-                                    shell=True)
-        except subprocess.CalledProcessError as exError:
-            print('%s rrdtool update failed: %s' % \
-                  (rrdbase.getTimeStamp(), exError.output.decode('utf-8')))
+        if not lSamples:
             return False
 
-        if self.verboseMode and not self.debugMode:
-            print('database update successful')
+        # Create the rrdtool command for updating the rrdtool database.
+        lCmd = ['update', self.rrdFile] + lSamples
+
+        if self.runRrdtool(lCmd) is None:
+            return False
+
+        logger.debug('database update successful: %d samples', len(lSamples))
 
         return True
     ## end def
@@ -146,74 +323,72 @@ class rrdbase:
                    lower and upper parameters to set vertical axis scale
            Returns: True if successful, False otherwise
         """
+        # The charts are redrawn with the same arguments every cycle, so
+        # each graph command is only formatted the first time it is used.
+        tArgs = (fileName, dataItem, gLabel, gTitle, gStart, lower, upper, \
+                 addTrend, autoScale)
+        lCmd = self.graphCommands.get(tArgs)
+        if lCmd is None:
+            lCmd = self.getGraphCommand(*tArgs)
+            self.graphCommands[tArgs] = lCmd
+
+        # Run the rrdtool command.
+        result = self.runRrdtool(lCmd)
+        if result is None:
+            return False
+
+        logger.debug('rrdtool graph: %s', result)
+
+        return True
+    ## end def
+
+    def getGraphCommand(self, fileName, dataItem, gLabel, gTitle, gStart,
+                        lower, upper, addTrend, autoScale):
+        """Formats the rrdtool command that creates a graph of the
+           specified weather data item.
+           Parameters:
+               the same as createWeaGraph
+           Returns: tuple containing the rrdtool graph command
+        """
         gPath = self.chartsDirectory + fileName + '.png'
 
-        # Format the rrdtool graph command.
+        # Format the rrdtool graph command.  Each command line argument
+        # is a separate list item, so arguments such as titles may
+        # contain spaces.
 
         # Set chart start time, height, and width.
-        strCmd = 'rrdtool graph %s -a PNG -s %s -e \'now\' -w %s -h %s ' \
-                 % (gPath, gStart, self.chartWidth, self.chartHeight)
+        lCmd = ['graph', gPath, '-a', 'PNG', '-s', gStart, '-e', 'now'] + \
+               self.chartSizeArgs
        
         # Set the range and scaling of the chart y-axis.
         if lower < upper:
-            strCmd  +=  '-l %s -u %s -r ' % (lower, upper)
+            lCmd += ['-l', str(lower), '-u', str(upper), '-r']
         elif autoScale:
-            strCmd += '-A '
-        strCmd += '-Y '
+            lCmd += ['-A']
+        lCmd += ['-Y']
 
         # Set the chart ordinate label and chart title. 
-        strCmd += '-v %s -t %s ' % (gLabel, gTitle)
+        lCmd += ['-v', gLabel, '-t', gTitle]
 
         # Show the data, or a moving average trend line, or both.
-        strCmd += 'DEF:dSeries=%s:%s:AVERAGE ' % (self.rrdFile, dataItem)
+        lCmd += ['DEF:dSeries=%s:%s:AVERAGE' % (self.rrdFile, dataItem)]
         if addTrend == 0:
-            strCmd += 'LINE1:dSeries#0400ff '
+            lCmd += ['LINE1:dSeries#0400ff']
         elif addTrend == 1:
-            strCmd += 'CDEF:smoothed=dSeries,86400,TREND LINE2:smoothed#006600 '
+            lCmd += ['CDEF:smoothed=dSeries,86400,TREND', \
+                     'LINE2:smoothed#006600']
         elif addTrend == 2:
-            strCmd += 'LINE1:dSeries#0400ff '
-            strCmd += 'CDEF:smoothed=dSeries,86400,TREND LINE2:smoothed#006600 '
+            lCmd += ['LINE1:dSeries#0400ff']
+            lCmd += ['CDEF:smoothed=dSeries,86400,TREND', \
+                     'LINE2:smoothed#006600']
 
         # if wind plot show color coded wind direction
         if dataItem == 'windspeedmph':
-            strCmd += 'DEF:wDir=%s:winddir:AVERAGE ' % (_RRD_FILE)
-            strCmd += 'VDEF:wMax=dSeries,MAXIMUM '
-            strCmd += 'CDEF:wMaxScaled=dSeries,0,*,wMax,+,-0.15,* '
-            strCmd += 'CDEF:ndir=wDir,337.5,GE,wDir,22.5,LE,+,wMaxScaled,0,IF '
-            strCmd += 'CDEF:nedir=wDir,22.5,GT,wDir,67.5,LT,*,wMaxScaled,0,IF '
-            strCmd += 'CDEF:edir=wDir,67.5,GE,wDir,112.5,LE,*,wMaxScaled,0,IF '
-            strCmd += 'CDEF:sedir=wDir,112.5,GT,wDir,157.5,LT,*,wMaxScaled,0,IF '
-            strCmd += 'CDEF:sdir=wDir,157.5,GE,wDir,202.5,LE,*,wMaxScaled,0,IF '
-            strCmd += 'CDEF:swdir=wDir,202.5,GT,wDir,247.5,LT,*,wMaxScaled,0,IF '
-            strCmd += 'CDEF:wdir=wDir,247.5,GE,wDir,292.5,LE,*,wMaxScaled,0,IF '
-            strCmd += 'CDEF:nwdir=wDir,292.5,GT,wDir,337.5,LT,*,wMaxScaled,0,IF '
-      
-            strCmd += 'AREA:ndir#0000FF:N '    # Blue
-            strCmd += 'AREA:nedir#1E90FF:NE '  # DodgerBlue
-            strCmd += 'AREA:edir#00FFFF:E '    # Cyan
-            strCmd += 'AREA:sedir#00FF00:SE '  # Lime
-            strCmd += 'AREA:sdir#FFFF00:S '    # Yellow
-            strCmd += 'AREA:swdir#FF8C00:SW '  # DarkOrange 
-            strCmd += 'AREA:wdir#FF0000:W '    # Red
-            strCmd += 'AREA:nwdir#FF00FF:NW '  # Magenta
+            lCmd += ['DEF:wDir=%s:winddir:AVERAGE' % (self.rrdFile)]
+            lCmd += _WIND_DIRECTION_ARGS
         ##end if
-        
-        if self.debugMode:
-            print('%s' % strCmd) # DEBUG
-        
-        # Run the formatted rrdtool command as a subprocess.
-        try:
-            result = subprocess.check_output(strCmd, \
-                         stderr=subprocess.STDOUT,   \
-                         shell=True)
-        except subprocess.CalledProcessError as exError:
-            print('rrdtool graph failed: %s' % (exError.output.decode('utf-8')))
-            return False
-
-        if self.verboseMode:
-            print('rrdtool graph: %s' % result.decode('utf-8')) #, end='')
 
-        return True
+        return tuple(lCmd)
     ## end def
 
     def createAutoGraph(self, fileName, dataItem, gLabel, gTitle, gStart,
@@ -243,46 +418,38 @@ class rrdbase:
         # Format the rrdtool graph command.
 
         # Set chart start time, height, and width.
-        strCmd = "rrdtool graph %s -a PNG -s %s -e now -w %s -h %s " \
-                 % (gPath, gStart, self.chartWidth, self.chartHeight)
+        lCmd = ["graph", gPath, "-a", "PNG", "-s", gStart, "-e", "now"] + \
+               self.chartSizeArgs
        
         # Set the range and scaling of the chart y-axis.
         if lower < upper:
-            strCmd  +=  "-l %s -u %s -r " % (lower, upper)
+            lCmd += ["-l", str(lower), "-u", str(upper), "-r"]
         elif autoScale:
-            strCmd += "-A "
-        strCmd += "-Y "
+            lCmd += ["-A"]
+        lCmd += ["-Y"]
 
         # Set the chart ordinate label and chart title. 
-        strCmd += "-v %s -t %s " % (gLabel, gTitle)
+        lCmd += ["-v", gLabel, "-t", gTitle]
      
         # Show the data, or a moving average trend line over
         # the data, or both.
-        strCmd += "DEF:dSeries=%s:%s:LAST " % (self.rrdFile, dataItem)
+        lCmd += ["DEF:dSeries=%s:%s:LAST" % (self.rrdFile, dataItem)]
         if addTrend == 0:
-            strCmd += "LINE1:dSeries#0400ff "
+            lCmd += ["LINE1:dSeries#0400ff"]
         elif addTrend == 1:
-            strCmd += "CDEF:smoothed=dSeries,%s,TREND LINE2:smoothed#006600 " \
-                      % trendWindow[gStart]
+            lCmd += ["CDEF:smoothed=dSeries,%s,TREND" % trendWindow[gStart], \
+                     "LINE2:smoothed#006600"]
         elif addTrend == 2:
-            strCmd += "LINE1:dSeries#0400ff "
-            strCmd += "CDEF:smoothed=dSeries,%s,TREND LINE2:smoothed#006600 " \
-                      % trendWindow[gStart]
+            lCmd += ["LINE1:dSeries#0400ff"]
+            lCmd += ["CDEF:smoothed=dSeries,%s,TREND" % trendWindow[gStart], \
+                     "LINE2:smoothed#006600"]
          
-        if self.debugMode:
-            print("%s" % strCmd) # DEBUG
-        
-        # Run the formatted rrdtool command as a subprocess.
-        try:
-            result = subprocess.check_output(strCmd, \
-                         stderr=subprocess.STDOUT,   \
-                         shell=True)
-        except subprocess.CalledProcessError as exError:
-            print("rrdtool graph failed: %s" % (exError.output.decode('utf-8')))
+        # Run the rrdtool command.
+        result = self.runRrdtool(lCmd)
+        if result is None:
             return False
 
-        if self.verboseMode:
-            print("rrdtool graph: %s" % result.decode('utf-8')) #, end='')
+        logger.debug("rrdtool graph: %s", result)
         return True
 
     ##end def
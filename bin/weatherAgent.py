@@ -42,13 +42,28 @@
 
 import os
 import sys
+import argparse
 import signal
 import multiprocessing
+import gc
 import time
 import json
-from urllib.request import urlopen
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import random
+import re
+from queue import Empty
+import http.client
+from urllib.parse import urlsplit
 import rrdbase
 
+# Use the orjson module, if installed, to format the output data.
+# Otherwise use the json module.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
    ### ENVIRONMENT ###
 
 _USER = os.environ['USER']
@@ -67,8 +82,12 @@ _USER = os.environ['USER']
 _DOCROOT_DIRECTORY = '/home/%s/public_html/weather/' % _USER
 # location of weather charts used by html documents
 _CHARTS_DIRECTORY = _DOCROOT_DIRECTORY + 'dynamic/'
+# folder containing the output data file
+_OUTPUT_DATA_DIRECTORY = _DOCROOT_DIRECTORY + 'dynamic/'
 # data for use by other services and html documents
-_OUTPUT_DATA_FILE = _DOCROOT_DIRECTORY + 'dynamic/weatherData.js'
+_OUTPUT_DATA_FILE = _OUTPUT_DATA_DIRECTORY + 'weatherData.js'
+# temporary file used to atomically replace the output data file
+_OUTPUT_TEMP_FILE = _OUTPUT_DATA_DIRECTORY + '.weatherData.js.tmp'
 # rrdtool database file
 _RRD_FILE = '/home/%s/database/weatherData.rrd' % _USER
 
@@ -82,6 +101,8 @@ _MAX_HTTP_RETRIES = 5
 _HTTP_RETRY_DELAY = 2.1199
 # interval in seconds between data requests
 _DEFAULT_DATA_REQUEST_INTERVAL = 60
+# maximum interval in seconds between data requests while station offline
+_MAX_DATA_REQUEST_INTERVAL = 300
 # number seconds to wait for a response to HTTP request
 _HTTP_REQUEST_TIMEOUT = 3
 
@@ -95,9 +116,32 @@ _LONG_CHART_UPDATE_INTERVAL = 3600
 _CHART_WIDTH = 600
 # standard chart height in pixels
 _CHART_HEIGHT = 150
+# number of threads used to generate charts
+_MAX_GRAPH_WORKERS = 4
+# seconds to wait for the rrdtool worker to finish when terminating
+_RRD_WORKER_STOP_TIMEOUT = 5
+# seconds between checks by the rrdtool worker that the main process is
+# still running
+_RRD_WORKER_PARENT_CHECK_INTERVAL = 5
+# number of data samples written to the database in one rrdtool update
+_RRD_UPDATE_BATCH_SIZE = 5
+# maximum interval in seconds between chart updates when no new data
+# has been written to the database
+_MAX_CHART_UPDATE_INTERVAL = 86400
+# The rrdtool worker process is forked, so it inherits the rrdb object
+# and other module globals set up by the main process.
+_MP_CONTEXT = multiprocessing.get_context('fork')
+# maximum number of data requests in a row that skip writing the output
+# data file because the data is unchanged; the file date shown by html
+# documents is then at most this many poll intervals old
+_MAX_OUTPUT_FILE_SKIPS = 4
 
 # seconds waited after midnight reset before next data request
 _MIDNIGHT_RESET_HOLDOFF = 50
+# returned by getWeatherData when the station data has not changed
+_DATA_NOT_MODIFIED = 'not modified'
+# matches the key=value data items in the weather station data string
+_DATA_ITEM_REGEX = re.compile(r'([a-z0-9]+)=([^,#$]+)')
 
    ### CONVERSION FACTORS ###
 
@@ -111,6 +155,36 @@ _HUMIDITY_CORRECTION = 10.0
 # conversion of light sensor to percentage value
 _MIN_LIGHT_LVL = 2.7
 _MAX_LIGHT_LVL = 3.2
+_LIGHT_SCALE = 100.0 / (_MAX_LIGHT_LVL - _MIN_LIGHT_LVL)
+
+   ### DATA VALIDATION LIMITS ###
+
+# valid range of barometric pressure in inches Hg
+_MIN_PRESSURE = 25
+_MAX_PRESSURE = 35
+# minimum valid temperature in degrees Fahrenheit
+_MIN_TEMPERATURE = -100
+# maximum valid relative humidity in percent
+_MAX_HUMIDITY = 110
+
+   ### DATA ITEM NAMES ###
+
+# weather station data item names and their long form names
+_DATA_ITEM_NAMES = (
+    ('h', 'humidity'),
+    ('t', 'tempf'),
+    ('r', 'rainin'),
+    ('dr', 'dailyrainin'),
+    ('p', 'pressure'),
+    ('b', 'batt_lvl'),
+    ('l', 'light_lvl'),
+)
+# maps the short form key names to their long form names
+_DATA_ITEM_RENAMES = dict(_DATA_ITEM_NAMES)
+# data items compared to detect changes in the weather data
+_DATA_ITEM_KEYS = tuple(name for key, name in _DATA_ITEM_NAMES)
+# data items that must be present in the weather station data string
+_REQUIRED_DATA_ITEMS = frozenset(_DATA_ITEM_KEYS)
 
    ### GLOBAL VARIABLES ###
 
@@ -124,63 +198,158 @@ testMidnightReset = False
 # used for detecting system faults and weather station online
 # or offline status
 failedUpdateCount = 0
-httpRetries = 0
 stationOnline = False
 
 # periodicity of http requests sent to the weather station
 #   can be modified by command line argument
 dataRequestInterval = _DEFAULT_DATA_REQUEST_INTERVAL
+# current periodicity of http requests - increases while the station
+# is offline and returns to the data request interval when back online
+pollInterval = _DEFAULT_DATA_REQUEST_INTERVAL
 # weather station url
 #   can be modified by command line argument
 weatherStationUrl = _DEFAULT_WEATHER_STATION_URL
-# used for testing midnight reset feature
-testResetOffsetSec = -1
+# number seconds to wait for a response to HTTP request
+#   can be modified by command line argument
+httpRequestTimeout = _HTTP_REQUEST_TIMEOUT
+# adjustment to the scheduling priority of the agent process
+#   can be modified by command line argument
+niceIncrement = 0
+# address of the rrdtool caching daemon, if the daemon is to be used
+#   can be modified by command line argument
+rrdcachedAddress = ''
+# entity tag of the last weather station response
+lastEtag = ''
+# content of the last weather station data response
+lastContent = ''
+# host and path of the weather station url, used in http requests
+stationHost = ''
+stationPath = '/'
+# http connection to the weather station, kept open between requests
+httpConnection = None
+# time in seconds of the next weather station midnight reset
+nextMidnightResetTime = -1
 # weather station maintenance command
 maintenanceCommand = ''
 # global object for rrdtool database functions
 rrdb = None
+# queue of requests sent to the rrdtool worker process
+rrdQueue = None
+# worker process that performs all rrdtool database and chart functions
+rrdProcess = None
+# time stamp of the current main loop cycle
+currentTimeStamp = ''
+# data items last written to the output data file
+lastOutputData = None
+# True if the output data file may contain weather data; initially True
+# in case a previous agent process left data in the file
+outputFileHasData = True
+
+# log messages are time stamped by the logging module when written
+logger = logging.getLogger('weatherAgent')
 
     ### HELPER FUNCTIONS ###
 
 def getTimeStamp():
-    """Sets the error message time stamp to the local system time.
+    """Gets the weather data time stamp from the local system time.
+       Within a main loop cycle the time stamp of the cycle is returned,
+       so that all data processed during the cycle carry the same time.
        Parameters: none
        Returns: string containing the time stamp
     """
+    if currentTimeStamp:
+        return currentTimeStamp
     return time.strftime('%m/%d/%Y %H:%M:%S', time.localtime())
 ## end def
 
+def getNextMidnight(currentTime):
+    """Gets the time of the first local midnight after the supplied
+       time.  The time is found from the calendar date, so that it is
+       correct on days when daylight saving time begins or ends.
+       Parameters:
+           currentTime - the time in seconds from which to start
+       Returns: the time in seconds of the next midnight
+    """
+    now = time.localtime(currentTime)
+    # mktime carries the day past the end of the month over to the
+    # next month.
+    return time.mktime((now.tm_year, now.tm_mon, now.tm_mday + 1, \
+                        0, 0, 0, 0, 0, -1))
+## end def
+
+def getNextDeadline(deadline, interval, currentTime):
+    """Gets the time of the next occurrence of an event that is scheduled
+       at a fixed interval.  The deadline is advanced by whole intervals,
+       so that the times of the event do not drift, and occurrences
+       missed while the agent was busy are skipped.
+       Parameters:
+           deadline - the time the event was last scheduled for
+           interval - the interval in seconds between events
+           currentTime - the current time in seconds
+       Returns: the time in seconds of the next occurrence of the event
+    """
+    deadline += interval
+    if deadline <= currentTime:
+        deadline += interval * (int((currentTime - deadline) / interval) + 1)
+    return deadline
+## end def
+
+def clearOutputFile():
+    """Truncate the output data file to zero length, if this process has
+       written data to it or data was left by a previous process.  The
+       file is truncated rather than removed, so that web page requests
+       made while the station is offline do not fail with 404 errors.
+       Parameters: none
+       Returns: nothing
+    """
+    global outputFileHasData
+
+    if outputFileHasData:
+        try:
+            os.truncate(_OUTPUT_DATA_FILE, 0)
+        except FileNotFoundError:
+            pass
+        outputFileHasData = False
+## end def
+
 def setStatusToOffline():
-    """Set weather station status to offline.  Removing the output data
+    """Set weather station status to offline.  Clearing the output data
        file causes the client web page to show that the weather station
        is offline.
        Parameters: none
        Returns: nothing
     """
-    global stationOnline
+    global stationOnline, lastOutputData
 
-    # Inform downstream clients by removing output data file.
-    if os.path.exists(_OUTPUT_DATA_FILE):
-       os.remove(_OUTPUT_DATA_FILE)
+    # Inform downstream clients by clearing the output data file.
+    clearOutputFile()
+    lastOutputData = None
 
     if stationOnline:
-        print('%s weather station offline' % getTimeStamp())
+        logger.info('weather station offline')
     stationOnline = False
 ## end def
 
 def terminateAgentProcess(signal, frame):
-    """Send message to log when process killed
+    """End the main loop when the process is killed.  The handler only
+       raises SystemExit, since the signal may arrive while the main loop
+       holds a lock, such as the lock of the rrdtool worker queue.  The
+       main routine cleans up as the exception unwinds.
        Parameters: signal, frame - sigint parameters
-       Returns: nothing
+       Returns: nothing; raises a SystemExit exception
     """
-    # Inform downstream clients by removing output data file.
-    if os.path.exists(_OUTPUT_DATA_FILE):
-       os.remove(_OUTPUT_DATA_FILE)
-    print('%s terminating weather agent process' % \
-              (getTimeStamp()))
     sys.exit(0)
 ## end def
 
+def httpRequestTimedOut(signal, frame):
+    """Abort an http request that has run longer than the http request
+       timeout.
+       Parameters: signal, frame - sigalrm parameters
+       Returns: nothing; raises a TimeoutError exception
+    """
+    raise TimeoutError('timed out after %s seconds' % httpRequestTimeout)
+## end def
+
 def verifyMidnightReset(dData):
     global maintenanceCommand
     # If reset command was sent to weather station then allow extra time
@@ -189,88 +358,138 @@ def verifyMidnightReset(dData):
     if dData['content'] == 'ok':
         maintenanceCommand = ''
         time.sleep(_MIDNIGHT_RESET_HOLDOFF)
-        if verboseMode:
-            print("%s midnight reset successful" % getTimeStamp())
+        logger.debug("midnight reset successful")
         return True
     else:
-        print("%s midnight reset failed: resending" % getTimeStamp())
+        logger.warning("midnight reset failed: resending")
         return False
     ## end if
 ## end def
 
 def testMidnightResetFeature():
     """Simple routine for testing station midnight reset feature by forcing
-       the transmission of a reset signal 60 seconds after this program
+       the transmission of a reset signal 120 seconds after this program
        starts.
        Parameters:
            none
        Returns:
            nothing
     """
-    global testResetOffsetSec
+    global nextMidnightResetTime
     _MIDNIGHT_RESET_DELAY = 120
 
-    now = time.localtime()
-    testResetOffsetSec = _MIDNIGHT_RESET_DELAY + now.tm_hour * 3600 + \
-        now.tm_min * 60 + now.tm_sec
+    nextMidnightResetTime = time.time() + _MIDNIGHT_RESET_DELAY
 ## end def
 
     ### PUBLIC FUNCTIONS ###
 
-def getWeatherData(dData):
+def getWeatherData(dData, conditional=False):
     """Send http request to the weather station.  The response
        contains the weather data, formatted
        as an html document.
     Parameters: 
-        weatherStationUrl - url of radiation monitoring device
-        HttpRequesttimeout - how long to wait for device
-                             to respond to http request
-    Returns a string containing the radiation data, or None if
-    not successful.
+        dData - a dictionary object to contain the response content
+        conditional - if True, and the station supplied an entity tag
+                      with its last response, then ask the station to
+                      send data only if the data has changed; also
+                      if True, a response identical to the last
+                      response is treated as unchanged data
+    Returns True if successful, _DATA_NOT_MODIFIED if the station data
+    has not changed since the last request, or False if not successful.
     """
-    global maintenanceCommand
-    global httpRetries
-
-    sUrl = weatherStationUrl + maintenanceCommand
-
-    try:
-        currentTime = time.time()
-        response = urlopen(sUrl, timeout=_HTTP_REQUEST_TIMEOUT)
-        requestTime = time.time() - currentTime
-
-        content = response.read().decode('utf-8')
-        content = content.replace('\n', '')
-        content = content.replace('\r', '')
-        if content == "":
-            raise Exception("empty response")
-
-    except Exception as exError:
-        # If no response is received from the device, then assume that
-        # the device is down or unavailable over the network.  In
-        # that case return None to the calling function.
-        httpRetries += 1
-
-        if reportUpdateFails:
-            print("%s " % getTimeStamp(), end='')
-        if reportUpdateFails or verboseMode:
-            print("http request failed (%d): %s" % \
-                (httpRetries, exError))
-
-        if httpRetries > _MAX_HTTP_RETRIES:
-            httpRetries = 0
-            return False
-        else:
+    global httpConnection, lastEtag, lastContent
+
+    sPath = stationPath + maintenanceCommand
+    dHeaders = {}
+    if conditional and lastEtag and not maintenanceCommand:
+        dHeaders['If-None-Match'] = lastEtag
+
+    for attempt in range(1, _MAX_HTTP_RETRIES + 2):
+        try:
+            currentTime = time.time()
+            # The connection timeout applies to each socket operation, so
+            # also limit the total time of the request with an interval
+            # timer.
+            signal.setitimer(signal.ITIMER_REAL, httpRequestTimeout)
+            try:
+                # Open a connection to the weather station, unless the
+                # connection from the last request is still open.
+                reused = httpConnection is not None
+                if not reused:
+                    httpConnection = http.client.HTTPConnection( \
+                        stationHost, timeout=httpRequestTimeout)
+                try:
+                    httpConnection.request('GET', sPath, headers=dHeaders)
+                    response = httpConnection.getresponse()
+                except (ConnectionResetError, BrokenPipeError):
+                    # The station may close a kept open connection while
+                    # it is idle between requests.  This is not a failed
+                    # request, so retry at once on a new connection.
+                    if not reused:
+                        raise
+                    logger.debug("http connection closed by station: " \
+                                 "reconnecting")
+                    httpConnection.close()
+                    httpConnection = http.client.HTTPConnection( \
+                        stationHost, timeout=httpRequestTimeout)
+                    httpConnection.request('GET', sPath, headers=dHeaders)
+                    response = httpConnection.getresponse()
+                content = response.read()
+            finally:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+            requestTime = time.time() - currentTime
+
+            # Close the connection if the station will not keep it open.
+            if response.will_close:
+                httpConnection.close()
+                httpConnection = None
+
+            if response.status == 304:
+                logger.debug("http request successful: data not modified")
+                return _DATA_NOT_MODIFIED
+            if response.status != 200:
+                raise Exception("HTTP Error %d: %s" % \
+                                (response.status, response.reason))
+            # Keep the entity tag of the station data, but not of the
+            # response to a maintenance command.
+            if not maintenanceCommand:
+                lastEtag = response.headers.get('ETag', '')
+
+            content = content.translate(None, b'\r\n').decode('utf-8')
+            if content == "":
+                raise Exception("empty response")
+            break
+
+        except Exception as exError:
+            # If no response is received from the device, then assume that
+            # the device is down or unavailable over the network.  Close
+            # the connection, and retry the request on a new connection
+            # after a short delay.
+            if httpConnection is not None:
+                httpConnection.close()
+                httpConnection = None
+
+            logger.log(logging.INFO if reportUpdateFails else logging.DEBUG, \
+                       "http request failed (%d): %s", attempt, exError)
+
+            if attempt > _MAX_HTTP_RETRIES:
+                return False
             time.sleep(_HTTP_RETRY_DELAY)
-            return getWeatherData(dData)
-    ## end try
+        ## end try
+    ## end for
 
     if debugMode:
-        print(content)
-    if verboseMode:
-        print("http request successful: "\
-              "%.4f seconds" % requestTime)
+        logger.debug(content)
+    logger.debug("http request successful: %.4f seconds", requestTime)
+
+    # Stations that do not supply entity tags always send the data, so
+    # compare the data with the last data received.
+    if not maintenanceCommand:
+        if conditional and content == lastContent:
+            logger.debug("data not modified")
+            return _DATA_NOT_MODIFIED
+        lastContent = content
 
-    httpRetries = 0
     dData['content'] = content
     return True
 ## end def
@@ -285,22 +504,24 @@ def parseDataString(dData):
     # Example input string
     #    $,h=73.4,t=58.5,p=101189.0,r=0.00,dr=0.00,b=3.94,l=1.1,#
     #
+    # The regular expression skips the '$,' and ',#' framing characters
+    # and returns a list of (key, value) tuples.  Short form key names
+    # are replaced by their long form names as the items are loaded.
     try:
         sData = dData.pop('content')
-        lData = sData[2:-2].split(',')
+        dItems = {_DATA_ITEM_RENAMES.get(key, key): value \
+                  for key, value in _DATA_ITEM_REGEX.findall(sData)}
     except Exception as exError:
-        print("%s parse failed: %s" % (getTimeStamp(), exError))
+        logger.error("parse failed: %s", exError)
         return False
     
-    # Verfy the expected number of data items have been received.
-    if len(lData) != 7:
-        print("%s parse failed: corrupted data string" % getTimeStamp())
-        return False;
+    # Verify all the required data items have been received.
+    if not _REQUIRED_DATA_ITEMS.issubset(dItems):
+        logger.error("parse failed: corrupted data string")
+        return False
 
     # Load the parsed data into a dictionary object for easy access.
-    for item in lData:
-        if "=" in item:
-            dData[item.split('=')[0]] = item.split('=')[1]
+    dData.update(dItems)
 
     # Add date and status to dictionary object
     dData['status'] = 'online'
@@ -310,10 +531,29 @@ def parseDataString(dData):
     return True
 ## end def
 
+def validateData(pressure, tempf, humidity):
+    """Verify that converted weather data items are within their valid
+       ranges.  Kept separate from convertData so that tools which
+       process recorded weather data can apply the same checks.
+       Parameters:
+           pressure - barometric pressure in inches Hg
+           tempf - temperature in degrees Fahrenheit
+           humidity - relative humidity in percent
+       Returns: nothing; raises an exception if a data item is invalid
+    """
+    if pressure < _MIN_PRESSURE or pressure > _MAX_PRESSURE:
+        raise Exception('invalid pressure: %.4e - discarding' % pressure)
+    if tempf < _MIN_TEMPERATURE:
+        #maintenanceCommand = '/' + _STATION_PIN + '/r'
+        raise Exception('invalid temperature: %.4e - discarding' % tempf)
+    if humidity > _MAX_HUMIDITY:
+        raise Exception('invalid humidity: %.4e - discarding' % humidity)
+## end def
+
 def convertData(dData):
     """Convert individual weather data items as necessary.  Also
-       format data items for use by html documents.  The keys
-       created below are specific to the Weather Underground service.
+       format data items for use by html documents.  The long form
+       key names are specific to the Weather Underground service.
        Parameters:
            dData - a dictionary object containing the data items to be
                    converted
@@ -322,50 +562,31 @@ def convertData(dData):
 
     try:
         # Convert pressure from pascals to inches Hg
-        pressureBar = float(dData['p']) * _PASCAL_CONVERSION_FACTOR + \
+        pressureBar = float(dData['pressure']) * _PASCAL_CONVERSION_FACTOR + \
                       _BAROMETRIC_PRESSURE_CORRECTION
-        dData['p'] = '%.2f' % pressureBar # format for web page
-        # Validate converted pressure
-        if pressureBar < 25 or pressureBar > 35:
-            raise Exception('invalid pressure: %.4e - discarding' % pressureBar)
+        dData['pressure'] = '%.2f' % pressureBar # format for web page
  
-        # Convert ambient light level to percent
-        lightLvl = float(dData['l'])
-        if lightLvl <= _MIN_LIGHT_LVL:
-            lightPct = 0
-        elif lightLvl >= _MAX_LIGHT_LVL:
-            lightPct = 100
-        else:
-            lightPct = round(100.0 * (lightLvl - _MIN_LIGHT_LVL) / \
-                       (_MAX_LIGHT_LVL - _MIN_LIGHT_LVL))
-        dData['l'] = '%d' % lightPct # format for web page
+        # Convert ambient light level to percent.  Light levels outside
+        # the sensor range are limited to the range.
+        lightLvl = min(max(float(dData['light_lvl']), _MIN_LIGHT_LVL), \
+                       _MAX_LIGHT_LVL)
+        lightPct = round((lightLvl - _MIN_LIGHT_LVL) * _LIGHT_SCALE)
+        dData['light_lvl'] = '%d' % lightPct # format for web page
 
  
-        # Validate temperature
-        tempf = float(dData['t'])
-        #dData['t'] = '%d' % round(tempf)
-        if tempf < -100:
-            #maintenanceCommand = '/' + _STATION_PIN + '/r'
-            raise Exception('invalid temperature: %.4e - discarding' % tempf)
-
-        # Validate humidity
-        humidity = float(dData['h']) - _HUMIDITY_CORRECTION
-        dData['h'] = '%d' % round(humidity) 
-        if humidity > 110:
-            raise Exception('invalid humidity: %.4e - discarding' % humidity)
-            
-        # Replace key names with their long form name.
-        dData['humidity'] = dData.pop('h')
-        dData['tempf'] = dData.pop('t')
-        dData['rainin'] = dData.pop('r')
-        dData['dailyrainin'] = dData.pop('dr')
-        dData['pressure'] = dData.pop('p')
-        dData['batt_lvl'] = dData.pop('b')
-        dData['light_lvl'] = dData.pop('l')
+        tempf = float(dData['tempf'])
+        #dData['tempf'] = '%d' % round(tempf)
+
+        # Apply humidity correction
+        humidity = float(dData['humidity']) - _HUMIDITY_CORRECTION
+        dData['humidity'] = '%d' % round(humidity) 
+
+        # Validate the converted data
+        validateData(pressureBar, tempf, humidity)
 
     # Trap any data conversion errors.
     except Exception as exError:
-        print('%s conversion error: %s' % (getTimeStamp(), exError))
+        logger.error('conversion error: %s', exError)
         return False
     ## end try
 
@@ -381,27 +602,50 @@ def writeOutputFile(dData):
            sOutputDataFile - the file to which to write the data
        Returns: True if successful, False otherwise
     """
+    global outputFileHasData
 
     # Format the weather data as string using java script object notation.
-    jsData = json.loads("{}")
     try:
-        for key in dData:
-            jsData.update({key:dData[key]})
-        sData = "[%s]" % json.dumps(jsData)
+        if orjson is not None:
+            bData = orjson.dumps([dData])
+        else:
+            bData = json.dumps([dData], separators=(",", ":")).encode('utf-8')
     except Exception as exError:
-        print("%s writeOutputFile: %s" % (getTimeStamp(), exError))
+        logger.error("writeOutputFile: %s", exError)
         return False
 
     if debugMode:
-        print(sData)
+        logger.debug(bData.decode('utf-8'))
 
-    # Write the string to the output data file for use by html documents.
+    # Write the string to a temporary file in the same folder as the
+    # output data file, then rename the temporary file to the output data
+    # file.  The rename is atomic, so html documents never read a partially
+    # written file.
+    try:
+        fd = os.open(_OUTPUT_TEMP_FILE, \
+                     os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    except Exception as exError:
+        logger.error('writeOutputFile: %s', exError)
+        return False
     try:
-        fc = open(_OUTPUT_DATA_FILE, 'w')
-        fc.write(sData)
-        fc.close()
+        # os.write may write only part of the data, so write the rest
+        # until all the data has been written.
+        payload = memoryview(bData)
+        while payload:
+            payload = payload[os.write(fd, payload):]
+        os.close(fd)
+        os.replace(_OUTPUT_TEMP_FILE, _OUTPUT_DATA_FILE)
+        outputFileHasData = True
     except Exception as exError:
-        print('%s writeOutputFile: %s' % (getTimeStamp(), exError))
+        logger.error('writeOutputFile: %s', exError)
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+        try:
+            os.unlink(_OUTPUT_TEMP_FILE)
+        except OSError:
+            pass
         return False
     return True
 ## end def
@@ -410,20 +654,25 @@ def setStationStatus(updateSuccess):
     """Detect if radiation monitor is offline or not available on
        the network. After a set number of attempts to get data
        from the monitor set a flag that the station is offline.
+       While the station is offline the interval between data requests
+       is doubled after each failed request, up to a maximum interval.
        Parameters:
            updateSuccess - a boolean that is True if data request
                            successful, False otherwise
        Returns: nothing
     """
     global failedUpdateCount, stationOnline, maintenanceCommand
+    global pollInterval, lastOutputData
 
     if updateSuccess:
         failedUpdateCount = 0
+        pollInterval = dataRequestInterval
         # Set status and send a message to the log if the device
         # previously offline and is now online.
         if not stationOnline:
-            print('%s weather station online' % getTimeStamp())
+            logger.info('weather station online')
             stationOnline = True
+            lastOutputData = None
         return
     else:
         # The last attempt failed, so update the failed attempts
@@ -435,32 +684,40 @@ def setStationStatus(updateSuccess):
         # device status to offline.
         maintenanceCommand = ''
         setStatusToOffline()
+
+    # Back off while the station is offline.  A random offset keeps
+    # multiple agents from polling in step with each other.  The back
+    # off never polls faster than the configured poll interval, which
+    # may be longer than the usual maximum.
+    if failedUpdateCount >= _MAX_FAILED_DATA_REQUESTS:
+        maxInterval = max(_MAX_DATA_REQUEST_INTERVAL, dataRequestInterval)
+        pollInterval = min(2 * pollInterval, maxInterval) + \
+                       random.uniform(0, 1)
+        logger.debug('next data request in %.1f seconds', pollInterval)
 ## end def
 
-def midnightReset(dData):
+def midnightReset(dData, currentTime):
     """Check the time to see if midnight has just occurred during the last
        device update cycle. If so, then send a reset message to the weather
        station.
-       Parameters: none
-       Returns: nothing
+       Parameters:
+           dData - a dictionary object to contain the station response
+           currentTime - the time in seconds of the current main loop cycle
+       Returns: True if successful, False otherwise
     """
-    global maintenanceCommand
-
-    # Get the number of seconds that have elapsed since midnight.
-    now = time.localtime()
-    secondsSinceMidnight = now.tm_hour * 3600 + now.tm_min * 60 + now.tm_sec
-    
-    # Perform a test of the midnight reset feature if requested.
-    if testResetOffsetSec > 0:
-        secondsSinceMidnight = abs(testResetOffsetSec - secondsSinceMidnight)
-
-    # If the number of elapsed seconds is smaller than the update interval
-    # then midnight has just occurred and the weather station needs to be
-    # sent its daily reset.
-    if secondsSinceMidnight < dataRequestInterval:
-        if verboseMode:
-            print('%s sending midnight reset signal' % \
-                 (getTimeStamp()))
+    global maintenanceCommand, nextMidnightResetTime
+
+    # The time of the next reset is found once a day, so that most
+    # cycles only compare the current time to it.
+    if nextMidnightResetTime < 0:
+        nextMidnightResetTime = getNextMidnight(currentTime)
+
+    # If midnight has occurred since the last cycle then the weather
+    # station needs to be sent its daily reset.  The reset is attempted
+    # once, in the first cycle after midnight.
+    if currentTime >= nextMidnightResetTime:
+        nextMidnightResetTime = getNextMidnight(currentTime)
+        logger.debug('sending midnight reset signal')
         #maintenanceCommand = '/' + _STATION_PIN + '/r'
         maintenanceCommand = '/' + _STATION_PIN + '/b'
         # Send reset maintenance command. Return true if command
@@ -476,108 +733,317 @@ def midnightReset(dData):
     ### GRAPH FUNCTIONS ###
 
 def generateDayGraphs():
-    """Generate graphs for html documents. Calls createGraph for each graph
-       that needs to be created.
+    """Generate graphs for html documents. Calls createGraphs to create
+       the graphs.
        Parameters: none
        Returns: nothing
     """
-    rrdb.createWeaGraph('1d_tempf', 'tempf', 'degrees\ Fahrenheit', \
-                'Temperature', 'now-1d', 0, 0, 0, True)
-    rrdb.createWeaGraph('1d_pressure', 'pressure', 'inches\ Hg', \
-                'Barometric\ Pressure', 'now-1d', 0, 0, 0, True)
-    rrdb.createWeaGraph('1d_humidity', 'humidity', 'percent', \
-                'Relative\ Humidity', 'now-1d', 0, 0, 0, True)
-    rrdb.createWeaGraph('1d_rainin', 'rainin', 'inches', \
-                'Rain\ Fall', 'now-1d', 0, 0, 0, False)
+    lGraphs = [
+        ('1d_tempf', 'tempf', 'degrees Fahrenheit', \
+         'Temperature', 'now-1d', 0, 0, 0, True),
+        ('1d_pressure', 'pressure', 'inches Hg', \
+         'Barometric Pressure', 'now-1d', 0, 0, 0, True),
+        ('1d_humidity', 'humidity', 'percent', \
+         'Relative Humidity', 'now-1d', 0, 0, 0, True),
+        ('1d_rainin', 'rainin', 'inches', \
+         'Rain Fall', 'now-1d', 0, 0, 0, False),
+    ]
+
+    createGraphs(lGraphs)
+## end def
+
+def createGraphs(lGraphs):
+    """Create the graphs in a list.  When rrdtool runs as command line
+       app processes, the graphs are created in parallel by a pool of
+       threads.  The rrdtool python bindings create one graph at a time,
+       so with the bindings the graphs are created in turn.
+       Parameters:
+           lGraphs - a list of tuples containing the createWeaGraph
+                     arguments
+       Returns: nothing
+    """
+    if not rrdb.parallelGraphs:
+        for tGraph in lGraphs:
+            createGraph(tGraph)
+        return
+
+    with ThreadPoolExecutor(max_workers=_MAX_GRAPH_WORKERS) as executor:
+        list(executor.map(createGraph, lGraphs))
+## end def
+
+def createGraph(tGraph):
+    """Create a single graph.  Used by createGraphs, and as the job
+       function of its thread pool.
+       Parameters:
+           tGraph - a tuple containing the createWeaGraph arguments
+       Returns: True if successful, False otherwise
+    """
+    return rrdb.createWeaGraph(*tGraph)
 ## end def
 
 def generateLongGraphs():
-    """Generate graphs for html documents. Calls createGraph for each graph
-       that needs to be created.
+    """Generate graphs for html documents. Calls createGraphs to create
+       the graphs.
        Parameters: none
        Returns: nothing
     """
-    # 10 day long graphs
-    rrdb.createWeaGraph('10d_tempf', 'tempf', 'degrees\ Fahrenheit', \
-                'Temperature', 'end-10days',0, 0, 0, True)
-    rrdb.createWeaGraph('10d_pressure', 'pressure', 'inches\ Hg', \
-                'Barometric\ Pressure', 'end-10days',0, 0, 0, True)
-    rrdb.createWeaGraph('10d_humidity', 'humidity', 'percent', \
-                'Relative\ Humidity', 'end-10days', 0, 0, 0, True)
-    rrdb.createWeaGraph('10d_rainin', 'rainin', 'inches', \
-                'Rain\ Fall', 'end-10days', 0, 0, 0, False)
-
-    # 3 month long graphs
-    rrdb.createWeaGraph('3m_tempf', 'tempf', 'degrees\ Fahrenheit', \
-                'Temperature', 'end-3months',0, 0, 2, True)
-    rrdb.createWeaGraph('3m_pressure', 'pressure', 'inches\ Hg', \
-#                'Barometric\ Pressure', 'end-3months', 29.0, 30.8, 2, True)
-                'Barometric\ Pressure', 'end-3months', 0, 0, 2, True)
-    rrdb.createWeaGraph('3m_humidity', 'humidity', 'percent', \
-                'Relative\ Humidity', 'end-3months', 0, 0, 2, True)
-    rrdb.createWeaGraph('3m_rainin', 'rainin', 'inches', \
-                'Rain\ Fall', 'end-3months', 0, 0, 0, False)
-
-    # 12 month long graphs
-    rrdb.createWeaGraph('12m_tempf', 'tempf', 'degrees\ Fahrenheit', \
-                'Temperature', 'end-12months',0, 0, 0, True)
-    rrdb.createWeaGraph('12m_pressure', 'pressure', 'inches\ Hg', \
-#                'Barometric\ Pressure', 'end-12months', 29.0, 30.8, 1, True)
-                'Barometric\ Pressure', 'end-12months', 0, 0, 0, True)
-    rrdb.createWeaGraph('12m_humidity', 'humidity', 'percent', \
-                'Relative\ Humidity', 'end-12months', 0, 0, 0, True)
-    rrdb.createWeaGraph('12m_rainin', 'rainin', 'inches', \
-                'Rain\ Fall', 'end-12months', 0, 0, 0, False)
+    lGraphs = [
+        # 10 day long graphs
+        ('10d_tempf', 'tempf', 'degrees Fahrenheit', \
+         'Temperature', 'end-10days',0, 0, 0, True),
+        ('10d_pressure', 'pressure', 'inches Hg', \
+         'Barometric Pressure', 'end-10days',0, 0, 0, True),
+        ('10d_humidity', 'humidity', 'percent', \
+         'Relative Humidity', 'end-10days', 0, 0, 0, True),
+        ('10d_rainin', 'rainin', 'inches', \
+         'Rain Fall', 'end-10days', 0, 0, 0, False),
+
+        # 3 month long graphs
+        ('3m_tempf', 'tempf', 'degrees Fahrenheit', \
+         'Temperature', 'end-3months',0, 0, 2, True),
+        ('3m_pressure', 'pressure', 'inches Hg', \
+#        'Barometric Pressure', 'end-3months', 29.0, 30.8, 2, True),
+         'Barometric Pressure', 'end-3months', 0, 0, 2, True),
+        ('3m_humidity', 'humidity', 'percent', \
+         'Relative Humidity', 'end-3months', 0, 0, 2, True),
+        ('3m_rainin', 'rainin', 'inches', \
+         'Rain Fall', 'end-3months', 0, 0, 0, False),
+
+        # 12 month long graphs
+        ('12m_tempf', 'tempf', 'degrees Fahrenheit', \
+         'Temperature', 'end-12months',0, 0, 0, True),
+        ('12m_pressure', 'pressure', 'inches Hg', \
+#        'Barometric Pressure', 'end-12months', 29.0, 30.8, 1, True),
+         'Barometric Pressure', 'end-12months', 0, 0, 0, True),
+        ('12m_humidity', 'humidity', 'percent', \
+         'Relative Humidity', 'end-12months', 0, 0, 0, True),
+        ('12m_rainin', 'rainin', 'inches', \
+         'Rain Fall', 'end-12months', 0, 0, 0, False),
+    ]
+
+    createGraphs(lGraphs)
+## end def
+
+    ### RRDTOOL WORKER FUNCTIONS ###
+
+def terminateRrdWorker(signal, frame):
+    """End the rrdtool worker when it is killed.  The worker writes its
+       pending data samples to the database as the exception unwinds.
+       Parameters: signal, frame - sigterm parameters
+       Returns: nothing; raises a SystemExit exception
+    """
+    sys.exit(0)
+## end def
+
+def writeRrdUpdates(lData):
+    """Write data samples to the rrdtool database in one rrdtool update.
+       If rrdtool rejects the batch, for example because one sample is
+       older than the last update after a clock step, then the samples
+       are written one at a time so that only the rejected samples are
+       lost.
+       Parameters:
+           lData - a list of tuple objects, each containing the data
+                   items of one sample
+       Returns: True if any sample was written, False otherwise
+    """
+    if rrdb.updateDatabaseBatch(lData):
+        return True
+    if len(lData) == 1:
+        return False
+    logger.warning('database update of %d samples failed: ' \
+                   'writing samples one at a time', len(lData))
+    lResults = [rrdb.updateDatabase(*tData) for tData in lData]
+    return any(lResults)
+## end def
+
+def rrdWorker(queue):
+    """Performs all rrdtool database updates and chart generation in a
+       separate process, so that slow rrdtool operations do not delay
+       the data requests made by the main loop.  Requests are taken from
+       the queue in the order the main loop sent them.  If chart requests
+       have backed up in the queue, each chart type is generated once.
+       Database updates are written in batches, and before charts are
+       generated so that the charts show the latest data.  Charts are
+       not generated again until new data has been written, except once
+       a day so that the chart time axes stay current.  The worker
+       writes its pending samples and stops when it is sent a stop
+       request or SIGTERM, or when the main process has died.
+       Parameters:
+           queue - the queue from which to get requests; each request is
+                   a tuple whose first item is the request type
+       Returns: nothing
+    """
+    # A service manager or the weastop script may send SIGTERM to this
+    # process along with the main process.  The worker then writes its
+    # pending data samples before it exits.  SIGINT from a terminal is
+    # handled by the main process, which stops this process.
+    signal.signal(signal.SIGTERM, terminateRrdWorker)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    parentPid = os.getppid()
+
+    # data samples waiting to be written to the database
+    lPendingUpdates = []
+    # chart types that have not been generated since data was written
+    staleCharts = {'graph_day', 'graph_long'}
+    # time each chart type was last generated
+    dChartTimes = {'graph_day': 0.0, 'graph_long': 0.0}
+
+    try:
+        while True:
+            try:
+                lRequests = [queue.get( \
+                    timeout=_RRD_WORKER_PARENT_CHECK_INTERVAL)]
+            except Empty:
+                # Stop if the main process has died, since the worker
+                # would otherwise be left running without it.
+                if os.getppid() != parentPid:
+                    logger.warning('agent process stopped: ' \
+                                   'stopping rrdtool worker')
+                    break
+                continue
+            # Collect any other requests already waiting in the queue.
+            while True:
+                try:
+                    lRequests.append(queue.get_nowait())
+                except Empty:
+                    break
+
+            lPendingUpdates += [tRequest[1] for tRequest in lRequests \
+                                if tRequest[0] == 'update']
+            lTypes = [tRequest[0] for tRequest in lRequests]
+
+            # Write the pending samples to the database.
+            if lPendingUpdates and \
+               (len(lPendingUpdates) >= _RRD_UPDATE_BATCH_SIZE or \
+                'graph_day' in lTypes or 'graph_long' in lTypes or \
+                'stop' in lTypes):
+                if writeRrdUpdates(lPendingUpdates):
+                    staleCharts = {'graph_day', 'graph_long'}
+                lPendingUpdates = []
+
+            # Stop without generating charts, which may take longer than
+            # the main process waits for the worker to stop.
+            if 'stop' in lTypes:
+                break
+
+            # Skip generating charts if no data has been written since
+            # they were last generated, such as while the station is
+            # offline.
+            for chartType, generateGraphs in \
+                (('graph_day', generateDayGraphs), \
+                 ('graph_long', generateLongGraphs)):
+                if chartType not in lTypes:
+                    continue
+                chartTime = time.monotonic()
+                if chartType in staleCharts or chartTime - \
+                   dChartTimes[chartType] >= _MAX_CHART_UPDATE_INTERVAL:
+                    generateGraphs()
+                    staleCharts.discard(chartType)
+                    dChartTimes[chartType] = chartTime
+        ## end while
+    finally:
+        # Write any samples not yet written, such as when the worker is
+        # sent SIGTERM, and do not let a second signal interrupt this.
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        if lPendingUpdates:
+            writeRrdUpdates(lPendingUpdates)
+        rrdb.closePipes()
+## end def
+
+def startRrdWorker():
+    """Start the rrdtool worker process.
+       Parameters: none
+       Returns: nothing
+    """
+    global rrdQueue, rrdProcess
+
+    rrdQueue = _MP_CONTEXT.Queue()
+    rrdProcess = _MP_CONTEXT.Process(target=rrdWorker, args=(rrdQueue,))
+    rrdProcess.start()
+## end def
+
+def stopRrdWorker():
+    """Stop the rrdtool worker process.  The worker is allowed to finish
+       any queued requests, but is killed if it does not stop in time.
+       Parameters: none
+       Returns: nothing
+    """
+    if rrdProcess is None or not rrdProcess.is_alive():
+        return
+    rrdQueue.put(('stop',))
+    rrdProcess.join(_RRD_WORKER_STOP_TIMEOUT)
+    # The worker has not stopped, so kill it rather than send SIGTERM,
+    # which would have it try again to write to the database.
+    if rrdProcess.is_alive():
+        rrdProcess.kill()
+        rrdProcess.join()
 ## end def
 
 def getCLarguments():
-    """Get command line arguments - there are two possible arguments
+    """Get command line arguments - there are nine possible arguments
+          -c sets the rrdtool caching daemon address
           -d turns on debug mode
           -m test midnight reset procedure
+          -n adjusts the process scheduling priority (default=0)
           -p sets the update poll interval in seconds (default=60)
           -r report failed updates
+          -t sets the http request timeout in seconds (default=3)
           -u sets the weather station url
           -v turns on verbose mode
        Returns: nothing
     """
-    global verboseMode, debugMode, dataRequestInterval
+    global verboseMode, debugMode, dataRequestInterval, pollInterval
     global reportUpdateFails, weatherStationUrl, testMidnightReset
-
-    index = 1
-    while index < len(sys.argv):
-
-        # Debug and error reporting options
-        if sys.argv[index] == '-v':
-            verboseMode = True
-        elif sys.argv[index] == '-d':
-            verboseMode = True
-            debugMode = True
-        elif sys.argv[index] == '-r':
-            reportUpdateFails = True
-        elif sys.argv[index] == '-m':
-            testMidnightReset = True
-
-        # Update period and url options
-        elif sys.argv[index] == '-p':
-            try:
-                dataRequestInterval = abs(float(sys.argv[index + 1]))
-            except:
-                print("invalid polling period")
-                exit(-1)
-            index += 1
-        elif sys.argv[index] == '-u':
-            weatherStationUrl = sys.argv[index + 1]
-            if weatherStationUrl.find('http://') < 0:
-                weatherStationUrl = 'http://' + weatherStationUrl
-            index += 1
-        else:
-            cmd_name = sys.argv[0].split('/')
-            print("Usage: %s [-d|v|r] [-t seconds] [-u url]" % cmd_name[-1])
-            exit(-1)
-        ## end if
-        index += 1
-    ## end while
-    return
+    global httpRequestTimeout, niceIncrement, rrdcachedAddress
+
+    parser = argparse.ArgumentParser()
+    # Debug and error reporting options
+    parser.add_argument('-d', action='store_true', help='debug mode')
+    parser.add_argument('-m', action='store_true', \
+                        help='test midnight reset procedure')
+    parser.add_argument('-r', action='store_true', \
+                        help='report failed updates')
+    parser.add_argument('-v', action='store_true', help='verbose mode')
+    # Process scheduling option
+    parser.add_argument('-n', type=int, metavar='increment', \
+                        default=niceIncrement, \
+                        help='process niceness adjustment; negative ' \
+                             'values require root (default=%(default)s)')
+    # Update period and url options
+    parser.add_argument('-p', type=float, metavar='seconds', \
+                        default=dataRequestInterval, \
+                        help='update poll interval (default=%(default)s)')
+    parser.add_argument('-t', type=float, metavar='seconds', \
+                        default=httpRequestTimeout, \
+                        help='http request timeout (default=%(default)s)')
+    parser.add_argument('-u', metavar='url', default=weatherStationUrl, \
+                        help='weather station url')
+    # Database option
+    parser.add_argument('-c', metavar='address', default=rrdcachedAddress, \
+                        help='rrdtool caching daemon address, such as ' \
+                             'unix:/var/run/rrdcached.sock')
+    args = parser.parse_args()
+
+    # The main loop schedules data requests at whole multiples of the
+    # poll interval, and the http timeout sets an interval timer, so
+    # neither may be zero or negative.
+    if args.p <= 0:
+        parser.error('poll interval must be greater than zero')
+    if args.t <= 0:
+        parser.error('http request timeout must be greater than zero')
+
+    verboseMode = args.v or args.d
+    debugMode = args.d
+    reportUpdateFails = args.r
+    testMidnightReset = args.m
+    dataRequestInterval = args.p
+    pollInterval = dataRequestInterval
+    httpRequestTimeout = args.t
+    niceIncrement = args.n
+    rrdcachedAddress = args.c
+    weatherStationUrl = args.u
+    if not weatherStationUrl.startswith('http://'):
+        weatherStationUrl = 'http://' + weatherStationUrl
 ## end def
 
      ### MAIN ROUTINE ###
@@ -588,115 +1054,197 @@ def setup():
        Parameters: none
        Returns nothing.
     """
-    global rrdb
-
-    print('=====================================================')
-    print('%s starting up weather agent process' % \
-                  (getTimeStamp()))
+    global rrdb, stationHost, stationPath
 
     # Get the command line arguments.
     getCLarguments()
 
+    # Messages are time stamped when written to the log.  Debug messages
+    # are only formatted and written in verbose mode.
+    logging.basicConfig(stream=sys.stdout, format='%(asctime)s %(message)s', \
+                        datefmt='%m/%d/%Y %H:%M:%S', \
+                        level=logging.DEBUG if verboseMode else logging.INFO)
+
+    print('=====================================================')
+    logger.info('starting up weather agent process')
+
     if testMidnightReset:
         testMidnightResetFeature()
 
+    # Raise the scheduling priority of the agent if requested, so that
+    # data requests are made on time on a busy system.  The rrdtool
+    # worker, started below, inherits the priority.
+    if niceIncrement:
+        try:
+            logger.info('process niceness set to %d', os.nice(niceIncrement))
+        except OSError as exError:
+            logger.warning('cannot set process niceness: %s', exError)
+
+    # Split the weather station url into the host to connect to and the
+    # path to request, so that requests do not parse the url.
+    url = urlsplit(weatherStationUrl)
+    stationHost = url.netloc
+    stationPath = url.path or '/'
+    if url.query:
+        stationPath += '?' + url.query
+
     # Exit with error if rrdtool database does not exist.
     if not os.path.exists(_RRD_FILE):
-        print('rrdtool database does not exist\n' \
-              'use createWeatherRrd script to ' \
-              'create rrdtool database\n')
+        logger.error('rrdtool database does not exist\n' \
+                     'use createWeatherRrd script to ' \
+                     'create rrdtool database\n')
         exit(1)
 
     signal.signal(signal.SIGTERM, terminateAgentProcess)
     signal.signal(signal.SIGINT, terminateAgentProcess)
+    signal.signal(signal.SIGALRM, httpRequestTimedOut)
+
+    # If requested, have rrdtool send database updates to the rrdtool
+    # caching daemon rather than writing to the database file.  The
+    # daemon writes the updates in batches, and flushes them to the
+    # database file before a chart is created.  The daemon is only used
+    # when its address is given, either by the command line or by the
+    # RRDCACHED_ADDRESS environment variable, so that a socket created
+    # by another user, or left by a stopped daemon, is never used.
+    if rrdcachedAddress:
+        os.environ['RRDCACHED_ADDRESS'] = rrdcachedAddress
+    if os.environ.get('RRDCACHED_ADDRESS'):
+        logger.info('using rrdcached at %s', os.environ['RRDCACHED_ADDRESS'])
 
     # Define object for calling rrdtool database functions.
     rrdb = rrdbase.rrdbase( _RRD_FILE, _CHARTS_DIRECTORY, _CHART_WIDTH, \
                             _CHART_HEIGHT, verboseMode, debugMode )
+
+    # The objects created during start up last for the life of the agent.
+    # Move them out of reach of the garbage collector, so that they are
+    # not scanned again, and so that the forked rrdtool worker shares
+    # their memory pages with this process rather than copying them.
+    gc.freeze()
+
+    # Start the process that performs all rrdtool functions.
+    startRrdWorker()
 ## end def
 
 def loop():
-     # last time the data file to the web server updated
-    lastDataRequestTime = -1
-    # last time day charts were generated
-    lastDayChartUpdateTime = -1
-    # last time long term charts were generated
-    lastLongChartUpdateTime = -1
-    # last time the rrdtool database updated
-    lastDatabaseUpdateTime = -1
+    global currentTimeStamp, lastOutputData
+
+    # Schedule the first data request, database update, and chart
+    # generation for now.  Later events are scheduled at fixed intervals
+    # from these times.  Events are scheduled by the monotonic clock, so
+    # that changes to the system clock do not affect the schedule.
+    # time of the next data request to the weather station
+    nextDataRequestTime = time.monotonic()
+    # time of the next day charts generation
+    nextDayChartTime = nextDataRequestTime
+    # time of the next long term charts generation
+    nextLongChartTime = nextDataRequestTime
+    # time of the next rrdtool database update
+    nextDatabaseUpdateTime = nextDataRequestTime
+    # number of data requests since the output data file was written
+    outputFileSkips = 0
+    # weather data processed during the last successful update
+    lastData = None
 
     while True:
 
         currentTime = time.time() # get current time in seconds
+        loopTime = time.monotonic() # get current monotonic clock time
+        currentTimeStamp = time.strftime('%m/%d/%Y %H:%M:%S', \
+                                         time.localtime(currentTime))
 
         # Every data update interval request data from the weather
         # station and process the received data.
-        if currentTime - lastDataRequestTime > dataRequestInterval:
-            lastDataRequestTime = currentTime
+        if loopTime >= nextDataRequestTime:
             dData = {}
  
             # At midnight send the reset signal to the weather station.
-            result = midnightReset(dData)
+            result = midnightReset(dData, currentTime)
 
             # Send a request for weather data to the weather station.
+            # Only ask for changed data if the last update succeeded.
             if result:
-                result = getWeatherData(dData)
-
-            # Upon successfully getting the data, parse the data.
-            if result:
-                 result = parseDataString(dData)
-
-            # If the station is online and the data successfully parsed, 
-            # then convert the data.
-            if result:
-                result = convertData(dData)
-
-            # If the data successfully converted, then the write the data
-            # to the output data file.
+                result = getWeatherData(dData, lastData is not None)
+
+            # If the station data has not changed, then skip processing
+            # the data and re-use the data from the last update.
+            if result == _DATA_NOT_MODIFIED:
+                dData = lastData
+                dData['date'] = currentTimeStamp
+            else:
+                # Upon successfully getting the data, parse the data.  If
+                # the data successfully parsed, then convert the data.
+                result = result and parseDataString(dData) and \
+                         convertData(dData)
+
+            # If the data successfully converted, then the write the
+            # data to the output data file.  Skip writing the file if
+            # the data has not changed and the file is recent.
             if result:
-               result = writeOutputFile(dData)
-
-            # At the rrdtool database update interval write the data to
-            # the rrdtool database.
-            if result and (currentTime - lastDatabaseUpdateTime >
-                           _DATABASE_UPDATE_INTERVAL):   
-                lastDatabaseUpdateTime = currentTime
+                outputData = tuple(dData[key] for key in _DATA_ITEM_KEYS)
+                if outputData != lastOutputData or \
+                   outputFileSkips >= _MAX_OUTPUT_FILE_SKIPS:
+                    result = writeOutputFile(dData)
+                    if result:
+                        lastOutputData = outputData
+                        outputFileSkips = 0
+                else:
+                    outputFileSkips += 1
+
+            # At the rrdtool database update interval send the data to
+            # the rrdtool worker to write to the rrdtool database.
+            if result and loopTime >= nextDatabaseUpdateTime:
+                nextDatabaseUpdateTime = getNextDeadline( \
+                    nextDatabaseUpdateTime, _DATABASE_UPDATE_INTERVAL, \
+                    loopTime)
                 # Update the round robin database with the parsed data
-                # passed as a tuple.
-                result = rrdb.updateDatabase(dData['date'], -1, -1, \
+                # passed as a tuple.  The time of the data is the
+                # time of this cycle in epoch seconds.
+                rrdQueue.put(('update', (int(currentTime), -1, -1, \
                          dData['tempf'], dData['rainin'], dData['pressure'], \
-                         dData['humidity'])
+                         dData['humidity'])))
+
+            lastData = dData if result else None
 
             # Set the station status to online or offline depending on the
             # success or failure of the above operations.
             setStationStatus(result)
+
+            # Provide a processing time information for debugging and
+            # performance analysis.
+            elapsedTime = time.monotonic() - loopTime
+            if result:
+                logger.debug("update successful: %6f sec\n", elapsedTime)
+            else:
+                logger.warning("update failed: %6f sec\n", elapsedTime)
+
+            # Schedule the next data request.  The poll interval may have
+            # been changed by the station status.
+            nextDataRequestTime = getNextDeadline(nextDataRequestTime, \
+                                              pollInterval, time.monotonic())
         ## end if
 
+        # Restart the rrdtool worker if it has stopped unexpectedly.
+        if not rrdProcess.is_alive():
+            logger.warning('rrdtool worker stopped: restarting')
+            startRrdWorker()
+
         # At the day chart generation interval generate day charts.
-        if currentTime - lastDayChartUpdateTime > _DAY_CHART_UPDATE_INTERVAL:
-            lastDayChartUpdateTime = currentTime
-            p = multiprocessing.Process(target=generateDayGraphs, args=())
-            p.start()
+        if loopTime >= nextDayChartTime:
+            nextDayChartTime = getNextDeadline(nextDayChartTime, \
+                               _DAY_CHART_UPDATE_INTERVAL, loopTime)
+            rrdQueue.put(('graph_day',))
 
         # At daily intervals generate long time period charts.
-        if currentTime - lastLongChartUpdateTime > _LONG_CHART_UPDATE_INTERVAL:
-            lastLongChartUpdateTime = currentTime
-            p = multiprocessing.Process(target=generateLongGraphs, args=())
-            p.start()
-
-        # Relinquish processing back to the operating system until
-        # the next update interval.  Also provide a processing time
-        # information for debugging and performance analysis.
-
-        elapsedTime = time.time() - currentTime
-        if result:
-            if verboseMode:
-                print("update successful: %6f sec\n"
-                      % elapsedTime)
-        else:
-            print("%s update failed: %6f sec\n"
-                      % (getTimeStamp(), elapsedTime))
-        remainingTime = dataRequestInterval - elapsedTime
+        if loopTime >= nextLongChartTime:
+            nextLongChartTime = getNextDeadline(nextLongChartTime, \
+                                _LONG_CHART_UPDATE_INTERVAL, loopTime)
+            rrdQueue.put(('graph_long',))
+
+        # Relinquish processing back to the operating system until the
+        # next scheduled event.  While the station is offline the poll
+        # interval may be longer than the chart intervals.
+        remainingTime = min(nextDataRequestTime, nextDayChartTime, \
+                            nextLongChartTime) - time.monotonic()
         if remainingTime > 0.0:
             time.sleep(remainingTime)
     ## end while
@@ -704,6 +1252,15 @@ def loop():
 
 if __name__ == '__main__':
     setup()
-    loop()
+    try:
+        loop()
+    finally:
+        # Ignore further signals so that the clean up is not interrupted.
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        # Inform downstream clients by clearing the output data file.
+        clearOutputFile()
+        stopRrdWorker()
+        logger.info('terminating weather agent process')
 
 ## end module